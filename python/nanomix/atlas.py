@@ -1,8 +1,169 @@
 import pyranges as pr
 import pandas as pd
 import numpy as np
+import os
+import json
+import hashlib
+import warnings
+from functools import lru_cache, cached_property
+from scipy.special import gammaln
+from scipy.linalg.blas import get_blas_funcs
 from tools import *
 
+# Rename columns
+COLUMNS = {'chromosome':'Chromosome', 'chr':'Chromosome',
+           'start':'Start',
+           'end':'End',
+           'start_position':'Start',
+           'end_position':'End'}
+KEYS = ['Chromosome', 'Start', 'End']
+
+# pyarrow is optional, it speeds up parsing the atlas and enables the parquet cache
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+def _parse_atlas(atlas):
+    if pyarrow is not None:
+        df_atlas = pd.read_csv(atlas, sep='\t', engine='pyarrow')
+    else:
+        df_atlas = pd.read_csv(atlas, sep='\t')
+    df_atlas = df_atlas.rename(columns=COLUMNS)
+    df_atlas.drop_duplicates(inplace=True)
+    if 'label' in df_atlas.columns: df_atlas.drop('label', axis=1, inplace=True)
+    df_atlas.dropna(inplace=True)
+    return df_atlas
+
+def _atlas_stamp(atlas):
+    """
+    Identify the current contents of the atlas file by its modification time in ns and its size
+    """
+    stat = os.stat(atlas)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _cache_paths(atlas):
+    """
+    Parquet cache locations for the atlas, in order of preference: next to the tsv,
+    then the user cache directory for atlases in read-only locations
+    """
+    user_cache = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache'))), 'nanomix')
+    name = hashlib.sha1(os.path.abspath(atlas).encode()).hexdigest() + '.parquet'
+    return [atlas + '.parquet', os.path.join(user_cache, name)]
+
+def _cached_source(cache):
+    try:
+        metadata = pyarrow.parquet.read_schema(cache).metadata or {}
+        return json.loads(metadata.get(b'nanomix_source', b'null'))
+    except (OSError, pyarrow.ArrowException, ValueError):
+        return None
+
+def _write_cache(df_atlas, stamp, caches):
+    table = pyarrow.Table.from_pandas(df_atlas, preserve_index=False)
+    source = json.dumps({'mtime_ns': stamp[0], 'size': stamp[1]}).encode()
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'nanomix_source': source})
+    errors = []
+    for cache in caches:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(cache)), exist_ok=True)
+            # write to a temporary file first so concurrent readers never see a partial cache
+            tmp = f'{cache}.{os.getpid()}.tmp'
+            pyarrow.parquet.write_table(table, tmp)
+            os.replace(tmp, cache)
+            return
+        except OSError as e:
+            errors.append(f'{cache}: {e}')
+    warnings.warn("Could not write the atlas parquet cache: " + '; '.join(errors))
+
+@lru_cache(maxsize=None)
+def _read_atlas(atlas, stamp):
+    # the cleaned atlas is kept as parquet, tagged with the mtime and size of the tsv it was parsed from,
+    # and reused only while the tsv still has exactly that mtime and size
+    if pyarrow is None:
+        return _parse_atlas(atlas)
+    caches = _cache_paths(atlas)
+    source = {'mtime_ns': stamp[0], 'size': stamp[1]}
+    for cache in caches:
+        if os.path.exists(cache) and _cached_source(cache) == source:
+            return pyarrow.parquet.read_table(cache).to_pandas()
+    df_atlas = _parse_atlas(atlas)
+    _write_cache(df_atlas, stamp, caches)
+    return df_atlas
+
+@lru_cache(maxsize=None)
+def _read_atlas_ranges(atlas, stamp):
+    return pr.PyRanges(_read_atlas(atlas, stamp)).sort()
+
+@lru_cache(maxsize=None)
+def _read_atlas_index(atlas, stamp):
+    return pd.MultiIndex.from_frame(_read_atlas(atlas, stamp)[KEYS])
+
+@lru_cache(maxsize=None)
+def _read_atlas_disjoint(atlas, stamp):
+    # regions are half-open, so once sorted by start no two overlap if each one starts
+    # at or after the end of the previous region on its chromosome
+    df = _read_atlas(atlas, stamp)[KEYS].sort_values(KEYS)
+    chrom = df.Chromosome.to_numpy()
+    same = chrom[1:] == chrom[:-1]
+    return bool(np.all(df.Start.to_numpy()[1:][same] >= df.End.to_numpy()[:-1][same]))
+
+def read_atlas(atlas):
+    """
+    Read and sort the reference atlas into PyRanges.
+    The result is cached on the path, modification time and size of the atlas,
+    so deconvoluting several methylomes against one atlas only parses it once.
+    With pyarrow installed the tsv is parsed with its reader and the cleaned
+    atlas is also cached on disk as <atlas>.parquet for later runs, or in the
+    user cache directory when the atlas directory is not writable.
+
+    :param atlas: Atlas file path
+    :return: sorted atlas regions
+    :rtype: pr.PyRanges
+    """
+    return _read_atlas_ranges(atlas, _atlas_stamp(atlas))
+
+def join_atlas(df, atlas, cell_types, threads=1):
+    """
+    Sum the calls of the methylome over the atlas regions they fall in.
+    When no two atlas regions overlap and every row of the methylome is exactly
+    an atlas region, rows are matched with a hash lookup on (Chromosome, Start, End)
+    and summed with bincount.
+    Otherwise rows are joined onto the atlas regions they overlap with PyRanges.
+
+    :param df: methylome with Chromosome, Start, End, modified_calls and total_calls columns
+    :param atlas: Atlas file path
+    :param cell_types: cell types in the atlas
+    :param threads: number of threads for the PyRanges join
+    :return: calls and atlas values for every covered region, indexed by region
+    :rtype: pd.DataFrame
+    """
+    stamp = _atlas_stamp(atlas)
+    index = _read_atlas_index(atlas, stamp)
+    # a row matching one region exactly also belongs to every other region it overlaps
+    if index.is_unique and _read_atlas_disjoint(atlas, stamp):
+        idx = index.get_indexer(pd.MultiIndex.from_frame(df[KEYS]))
+        if len(idx) > 0 and np.all(idx >= 0):
+            n = len(index)
+            covered = np.flatnonzero(np.bincount(idx, minlength=n))
+            df_join = _read_atlas(atlas, stamp).iloc[covered][KEYS + cell_types]
+            df_join.insert(3, 'modified_calls', np.bincount(idx, weights=df.modified_calls, minlength=n)[covered])
+            df_join.insert(4, 'total_calls', np.bincount(idx, weights=df.total_calls, minlength=n)[covered])
+            return df_join.set_index(KEYS).sort_index()
+    return _join_atlas_overlap(df, atlas, cell_types, threads=threads)
+
+def _join_atlas_overlap(df, atlas, cell_types, threads=1):
+    """
+    Sum the calls of the methylome over the atlas regions they overlap, with a PyRanges join.
+    Takes the same arguments and returns the same table as join_atlas.
+    """
+    gr_sample = pr.PyRanges(df).sort()
+    df = _read_atlas_ranges(atlas, _atlas_stamp(atlas)).join(gr_sample, nb_cpu=threads).df
+    df_grouped = df.groupby(KEYS, observed=True)
+    df_grouped_sample = df_grouped[['modified_calls', 'total_calls']].sum().sort_index()
+    df_grouped_atlas = df_grouped[cell_types].first().sort_index()
+    return df_grouped_sample.join(df_grouped_atlas)
+
 class AtlasMethylome:
     """
     Reference atlas class for storing the methylation propensities of each cell type
@@ -24,77 +185,83 @@ class AtlasMethylome:
         :return: self
         """
 
-        # Rename columns 
-        columns={'chromosome':'Chromosome', 'chr':'Chromosome',
-                                'start':'Start',
-                                'end':'End',
-                                'start_position':'Start',
-                                'end_position':'End'}
-
-        # Read atlas
-        df_atlas = pd.read_csv(atlas, sep='\t').rename(columns=columns)
-        df_atlas.drop_duplicates(inplace=True)
-        if 'label' in df_atlas.columns: df_atlas.drop('label', axis=1, inplace=True)
-        df_atlas.dropna(inplace=True)
-        gr_atlas = pr.PyRanges(df_atlas).sort()
-
         # Read methylomes data from mbtools
         try:
-            df = pd.read_csv(methylome, sep='\t').rename(columns=columns)
+            df = pd.read_csv(methylome, sep='\t').rename(columns=COLUMNS)
         except pd.errors.EmptyDataError:
             Exception("Empty methylome file")
         df.dropna(inplace=True)
-        gr_sample = pr.PyRanges(df).sort()
-        gr = gr_atlas.join(gr_sample, nb_cpu=threads)
+        cell_types = get_cell_types(atlas)
+        df_join = join_atlas(df, atlas, cell_types, threads=threads)
 
         # Check for empty upon join
-        cell_types = get_cell_types(atlas)
-        if len(gr) == 0:
+        if len(df_join) == 0:
             Exception("Empty join between atlas and sample. The sample does not overlap with any regions in the atlas.")
-        df = gr.df
-        df_grouped = df.groupby(['Chromosome', 'Start', 'End'], observed=True)
-        df_grouped_sample = df_grouped[['modified_calls', 'total_calls']].sum().sort_index()
-        df_grouped_atlas = df_grouped[cell_types].first().sort_index()
-        df_join = df_grouped_sample.join(df_grouped_atlas)
 
         self.t = np.array(df_join.total_calls, dtype=np.float32)
         self.m = np.array(df_join.modified_calls, dtype=np.float32)
         self.x_hat = self.m/self.t
 
-        self.cpg_ids = [(chrom, start, end) for chrom, start, end in df_join.index]
+        self.chrom = df_join.index.get_level_values('Chromosome').to_numpy(dtype=str)
+        self.start = df_join.index.get_level_values('Start').to_numpy(dtype=np.int32)
+        self.end = df_join.index.get_level_values('End').to_numpy(dtype=np.int32)
         self.K = len(cell_types)
-        self.v = {k:list(df_join[k]) for k in cell_types}
-        self.A = np.array(df_join.loc[:, list(cell_types)])
+        self.cell_types = list(cell_types)
+        # float32 matches the methylome arrays, so products with the atlas stay in single precision
+        self.A = np.ascontiguousarray(df_join[self.cell_types].to_numpy(dtype=np.float32))
 
-    def get_x(self, sigma):
+    @cached_property
+    def cpg_ids(self):
+        """
+        (Chromosome, Start, End) of every region, built on first use from the coordinate arrays
         """
-        Compute the expected methylome by matrix multiplication of the reference atlas and the cell-type proportions
+        return pd.MultiIndex.from_arrays([self.chrom, self.start, self.end], names=KEYS)
 
-        :param sigma: cell-type proportions
-        :return: expected methylome
+    @cached_property
+    def log_binomial_coefficient(self):
         """
-        return np.dot(self.A, sigma)
+        Sum of log binomial coefficients log(t choose m) over all CpGs.
+        It does not depend on sigma, so it is computed once per methylome.
+        """
+        t = self.t.astype(np.float64)
+        m = self.m.astype(np.float64)
+        return np.sum(gammaln(t+1) - gammaln(m+1) - gammaln(t-m+1))
 
-    def get_x(self, sigma, p01, p11):
+    def get_x(self, sigma, p01=None, p11=None, out=None):
         """
-        Compute the expected methylome by matrix multiplication of the reference atlas and the cell-type proportions
-        with vectorized p01, p11
+        Compute the expected methylome by matrix multiplication of the reference atlas and the cell-type proportions,
+        optionally with vectorized p01, p11. Uses BLAS gemv on the transposed view of the atlas so it is not copied.
 
         :param sigma: cell-type proportions
-        :param p01: p01 vector
-        :param p11: p11 vector
+        :param p01: p01 vector or scalar
+        :param p11: p11 vector or scalar
+        :param out: preallocated array with one entry per CpG, in the dtype of the atlas, to write the result into
         :return: expected methylome
         """
-        return np.dot(self.A, sigma*p11) + np.dot(1-self.A, sigma*p01)
+        K = self.A.shape[1]
+        sigma = np.asarray(sigma, dtype=self.A.dtype).ravel()
+        if out is None:
+            out = np.empty(self.A.shape[0], dtype=self.A.dtype)
+        gemv = get_blas_funcs('gemv', (self.A,))
+        if p01 is None:
+            return gemv(1.0, self.A.T, sigma, y=out, overwrite_y=1, trans=1)
+        p01 = np.broadcast_to(np.asarray(p01, dtype=np.float64).ravel(), (K,))
+        p11 = np.broadcast_to(np.asarray(p11, dtype=np.float64).ravel(), (K,))
+        # A@(sigma*p11) + (1-A)@(sigma*p01) folded into one product
+        out.fill(np.dot(sigma, p01))
+        return gemv(1.0, self.A.T, sigma*(p11 - p01), beta=1.0, y=out, overwrite_y=1, trans=1)
 
     def get_cell_types(self):
-        return list(self.v.keys())
+        return self.cell_types
 
     def get_num_cell_types(self):
-        return len(self.v.keys())
+        return self.A.shape[1]
+
+    def get_num_cpgs(self):
+        return self.A.shape[0]
 
     def __len__(self):
-        return len(self.cpg_ids)
+        return self.get_num_cpgs()
 
     def __repr__(self):
         return "AtlasMethylome with {} CpGs and {} cell types".format(len(self), self.get_num_cell_types())
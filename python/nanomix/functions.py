@@ -3,13 +3,14 @@ import csv
 from collections import Counter
 import os
 import sys
+from multiprocessing import Pool
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
 
 from _nanomix import *
 from models import fit_model, fit_mmse, log_likelihood_sequencing_with_errors, log_likelihood_sequencing_perfect
-from atlas import AtlasMethylome
+from atlas import AtlasMethylome, read_atlas
 from tools import *
 from plot import *
 
@@ -195,6 +196,41 @@ def log_likelihood(methylome, atlas, sigma, p01, p11, model):
     print("Log-likelihood\t{}".format(ll))
 
 
+def _fit_one_sample(methylome, atlas, model, p01, p11, n_trials, threads, concentration, nnls_init,
+                    sigma_init, max_iter, min_proportion, stop_thresh, solver, seed=None):
+    """
+    Deconvolute a single methylome. Top level so it can be mapped over a process pool.
+    Takes the arguments of deconvolute, with p01 and p11 already vectorized.
+
+    :param seed: np.random.SeedSequence to seed the random initializations with, so the result
+                 does not depend on which worker process fits the sample
+    :return: (methylome, cell type proportions)
+    :rtype: tuple
+    """
+    if seed is not None:
+        np.random.seed(seed.generate_state(1)[0])
+    if model == 'mmse':
+        if nnls_init:
+            sigma = fit_model(methylome, atlas, 'nnls', p01, p11, concentration=concentration, threads=threads)
+        else:
+            sigma = get_sigma_init(sigma_init, get_cell_types(atlas), concentration=concentration)
+        cell_type_proportions = fit_mmse(methylome, atlas, sigma, p01, p11, stop_thresh, max_iter, min_proportion, concentration)
+    else:
+        sigma = fit_model(methylome, atlas, model, p01, p11,
+                          n_trials=n_trials,
+                          threads=threads,
+                          concentration=concentration,
+                          nnls_init=nnls_init,
+                          solver=solver)
+        if min_proportion > 0.0:
+            sigma[sigma < min_proportion] = 0.0
+            sigma /= np.sum(sigma)
+        cell_type_proportions = {cell_type: proportion for cell_type, proportion in zip(get_cell_types(atlas), sigma)}
+    return methylome, cell_type_proportions
+
+def _fit_one_sample_star(args):
+    return _fit_one_sample(*args)
+
 def deconvolute(methylome, atlas, model,
                 p01=0.,
                 p11=1.,
@@ -206,11 +242,14 @@ def deconvolute(methylome, atlas, model,
                 max_iter=10,
                 min_proportion=0.01,
                 stop_thresh=1e-3,
+                solver='slsqp',
                 print_output=True):
     """
-    Deconvolute a methylome using a given model to get the proportion of each cell type present
+    Deconvolute a methylome using a given model to get the proportion of each cell type present.
+    Several methylomes are deconvoluted in parallel, one sample per process, with the trials of
+    each sample run serially.
 
-    :param methylome: Path to tsv file of methylome
+    :param methylome: Path to tsv file of methylome, or a list of paths
     :param atlas: Path to tsv file of atlas
     :param model: Deconvolution model options: [nnls, llse, llsp, mmse]
     :param p01: Sequencing miscall rate
@@ -219,7 +258,8 @@ def deconvolute(methylome, atlas, model,
     :param max_iter: Maximum number of iterations for the model (mmse only)
     :param min_proportion: Minimum proportion of a cell type to be considered (mmse only)
     :param stop_thresh: Threshold for stopping iterations (mmse only)
-    :return: none
+    :param solver: Optimizer options: [slsqp, lbfgs, minuit, em] (llse and llsp only)
+    :return: cell type proportions, or a dict of them keyed by methylome path for several methylomes
     """
 
     # if p01 is a string, then it is filepath
@@ -232,31 +272,39 @@ def deconvolute(methylome, atlas, model,
 
     if concentration is None:
         concentration = 1/len(get_cell_types(atlas))
+    # each methylome is fit and reported once, even if it is given twice
+    methylomes = [methylome] if isinstance(methylome, (str, os.PathLike)) else list(dict.fromkeys(methylome))
     # Run
-    if model == 'mmse':
-        if nnls_init:
-            sigma = fit_model(methylome, atlas, 'nnls', p01, p11, concentration=concentration, threads=threads)
-        else:
-            sigma = get_sigma_init(sigma_init, get_cell_types(atlas), concentration=concentration)
-        cell_type_proportions = fit_mmse(methylome, atlas, sigma, p01, p11, stop_thresh, max_iter, min_proportion, concentration)
+    if len(methylomes) == 1:
+        results = dict([_fit_one_sample(methylomes[0], atlas, model, p01, p11, n_trials, threads, concentration,
+                                        nnls_init, sigma_init, max_iter, min_proportion, stop_thresh, solver)])
     else:
-        sigma = fit_model(methylome, atlas, model, p01, p11,
-                          n_trials=n_trials,
-                          threads=threads,
-                          concentration=concentration,
-                          nnls_init=nnls_init)
-        if min_proportion > 0.0:
-            sigma[sigma < min_proportion] = 0.0
-            sigma /= np.sum(sigma)
-        cell_type_proportions = {cell_type: proportion for cell_type, proportion in zip(get_cell_types(atlas), sigma)}
+        # parallelize over samples, and run the trials of each sample serially.
+        # Forked workers inherit the random state of this process, so every sample gets its own seed
+        seeds = np.random.SeedSequence(np.random.randint(2**32, dtype=np.uint64)).spawn(len(methylomes))
+        sample_args = [(path, atlas, model, p01, p11, n_trials, 1, concentration, nnls_init,
+                        sigma_init, max_iter, min_proportion, stop_thresh, solver, seed)
+                       for path, seed in zip(methylomes, seeds)]
+        # parse the atlas here, so forked workers inherit it instead of each parsing it again
+        read_atlas(atlas)
+        with Pool(min(threads, len(methylomes))) as pool:
+            results = dict(pool.imap_unordered(_fit_one_sample_star, sample_args))
 
     # return deconvolution results
     if print_output:
-        print("cell_type\tproportion")
-        for cell_type, proportion in cell_type_proportions.items():
-            print(f"{cell_type}\t{proportion}")
-
-    return cell_type_proportions
+        if len(methylomes) == 1:
+            print("cell_type\tproportion")
+            for cell_type, proportion in results[methylomes[0]].items():
+                print(f"{cell_type}\t{proportion}")
+        else:
+            print("sample\tcell_type\tproportion")
+            for path in methylomes:
+                for cell_type, proportion in results[path].items():
+                    print(f"{path}\t{cell_type}\t{proportion}")
+
+    if isinstance(methylome, (str, os.PathLike)):
+        return results[methylome]
+    return {path: results[path] for path in methylomes}
 
 def assign_fragments(methylome, atlas, sigma,
                      p01=0., p11=1.,
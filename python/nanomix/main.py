@@ -59,7 +59,7 @@ Deconvolution Models:
     llsp:               log-likelihood with sequencing perfect. Same as llse, without error modelling. Useful for differentiating the
                         effect of sequencing errors on deconvolution loss and accuracy.
 """)
-    parser_deconvolute.add_argument('methylome', help='Path to methylome tsv file with columns: {chr, start, end, total_calls, modified_calls}')
+    parser_deconvolute.add_argument('methylome', nargs='+', help='Path to methylome tsv files with columns: {chr, start, end, total_calls, modified_calls}. Several methylomes are deconvoluted in parallel over --threads')
     parser_deconvolute.add_argument('-a', '--atlas', required=True, type=str, default=BISULFITE_ATLAS, help='Path to reference atlas')
     parser_deconvolute.add_argument('-p01', default=0.05, help='Sequencing miscall rate')
     parser_deconvolute.add_argument('-p11', default=0.95, help='Sequencing correct call rate')
@@ -72,6 +72,7 @@ Deconvolution Models:
     parser_deconvolute.add_argument('-n', '--max_iter', default=200, type=int, help='Maximum number of iterations for the EM optimization (mmse only)')
     parser_deconvolute.add_argument('-p', '--min_proportion', default=0.01, type=float, help='Minimum proportion of a cell type to be considered (mmse only)')
     parser_deconvolute.add_argument('-t', '--stop_thresh', default=1e-5, type=float, help='Stop EM iterations when percent change in log-likelihood falls below this value (mmse only)')
+    parser_deconvolute.add_argument('-s', '--solver', default='slsqp', type=str, choices=['slsqp', 'lbfgs', 'minuit', 'em'], help='Optimizer options: [slsqp, lbfgs, minuit, em] (llse and llsp only)')
     parser_deconvolute.set_defaults(func=deconvolute)
 
     parser_evaluate = subparsers.add_parser('evaluate', formatter_class=argparse.RawDescriptionHelpFormatter, description="""
@@ -1,16 +1,11 @@
 #! /usr/bin/env python
-import argparse
 import numpy as np
-import pandas as pd
-import pyranges as pr
-import math
-from scipy.stats import binom, dirichlet
-from scipy.optimize import minimize, nnls, Bounds
+from scipy.stats import dirichlet
+from scipy.optimize import minimize, nnls
+from scipy.linalg.blas import get_blas_funcs
 import os
 import sys
-from multiprocessing import Queue
-import threading
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
@@ -19,9 +14,18 @@ from _nanomix import *
 from atlas import AtlasMethylome
 from tools import *
 
+# iminuit is optional, it is only needed for the minuit solver
+try:
+    from iminuit import Minuit
+except ImportError:
+    Minuit = None
+
+# probabilities are clipped to [EPS, 1-EPS], which is representable in float32
+EPS = 1e-7
+
 def fit_model(methylome, atlas, model, p01, p11,
               threads=1, n_trials=5,
-              nnls_init=False, concentration=1.0):
+              nnls_init=False, concentration=1.0, solver='slsqp'):
     """
     Wrapper function to select model for deconvolution
     mmse model is initalized seperately with Rust bindings
@@ -32,21 +36,93 @@ def fit_model(methylome, atlas, model, p01, p11,
     :param model: model to fit
     :param p01: nanopore miscall rate
     :param p11: nanopore correct call rate
+    :param solver: optimizer for the llse and llsp models: [slsqp, lbfgs, minuit, em]
     :return: cell-type proportions
     """
     data = AtlasMethylome(methylome, atlas, threads=threads)
     if model == 'nnls':
         sigma = fit_nnls(data)
     elif model == 'llse':
-        sigma = fit_llse_parallel(data, p01, p11, n_trials, threads, concentration, nnls_init)
+        sigma = fit_llse_parallel(data, p01, p11, n_trials, threads, concentration, nnls_init, solver)
     elif model == 'llsp':
-        sigma = fit_llsp(data)
+        sigma = fit_llsp(data, threads=threads, solver=solver)
     elif model == 'null':
         sigma = fit_uniform(data)
     else:
         raise ValueError(f"no such model: {model}. Choose from [nnls, llse, llsp, mmse]")
     return sigma
 
+def _error_atlas(A, p01, p11):
+    """
+    Fold the sequencing error rates into the reference atlas so that the
+    probability of a modified call at each CpG is a single matrix product
+
+    :param A: reference atlas matrix (CpGs x cell-types)
+    :param p01: nanopore miscall rate per cell-type
+    :param p11: nanopore correct call rate per cell-type
+    :return: error corrected atlas matrix (CpGs x cell-types)
+    :rtype: np.array
+    """
+    # keep the error rates in the precision of the atlas so the product is not upcast
+    p01 = np.asarray(p01, dtype=A.dtype)
+    p11 = np.asarray(p11, dtype=A.dtype)
+    return A*p11 + (1-A)*p01
+
+def _log_likelihood(B, sigma, m, t):
+    """
+    Compute the log-likelihood of the llse model from plain arrays, up to the
+    binomial coefficient which does not depend on sigma
+
+    :param B: error corrected atlas matrix (CpGs x cell-types)
+    :param sigma: cell-type proportions (cell-types or cell-types x trials)
+    :param m: modified calls per CpG
+    :param t: total calls per CpG
+    :return: log-likelihood, one per column of sigma
+    :rtype: float
+    """
+    sigma = np.asarray(sigma, dtype=B.dtype)
+    if sigma.ndim == 2:
+        m = m[:, None]
+        t = t[:, None]
+    p = np.clip(np.dot(B, sigma), EPS, 1 - EPS)
+    return np.sum(m*np.log(p) + (t-m)*np.log1p(-p), axis=0, dtype=np.float64)
+
+def _neg_log_likelihood_and_grad(sigma, BT, m, tm, scale=1.0, out=None, gemv=None):
+    """
+    Compute the negative log-likelihood of the llse model and its analytic
+    gradient with respect to sigma, sharing the matrix product between both.
+    Both are multiplied by scale, which SLSQP uses to work per call.
+    The matrix products call BLAS gemv on BT directly, whose transpose is B
+    in Fortran order, so neither product copies the atlas.
+
+    :param sigma: cell-type proportions
+    :param BT: contiguous transpose of the error corrected atlas matrix (cell-types x CpGs)
+    :param m: modified calls per CpG
+    :param tm: unmodified calls per CpG (t - m)
+    :param scale: factor applied to the objective and gradient
+    :param out: three preallocated work arrays with one entry per CpG, reused across calls
+    :param gemv: BLAS gemv for the dtype of BT, resolved once per trial by the caller
+    :return: (negative log-likelihood, gradient)
+    :rtype: tuple
+    """
+    if out is None:
+        out = np.empty((3, BT.shape[1]), dtype=BT.dtype)
+    if gemv is None:
+        gemv = get_blas_funcs('gemv', (BT,))
+    p, q, w = out
+    p = gemv(1.0, BT.T, sigma, y=p, overwrite_y=1)
+    np.clip(p, EPS, 1 - EPS, out=p)
+    # w holds log(p), then log(1-p), then the residual
+    np.subtract(1, p, out=q)
+    np.log(p, out=w)
+    ll = np.dot(m, w)
+    np.log(q, out=w)
+    ll += np.dot(tm, w)
+    np.divide(m, p, out=w)
+    np.divide(tm, q, out=q)
+    w -= q
+    return -scale*float(ll), -scale*gemv(1.0, BT.T, w, trans=1).astype(np.float64)
+
 def log_likelihood_sequencing_perfect(data, sigma):
     """
     Compute the log-likelihood of the llsp model
@@ -57,37 +133,28 @@ def log_likelihood_sequencing_perfect(data, sigma):
     :return: log-likelihood
     :rtype: float
     """
-    sigma_t = sigma.reshape( (data.K, 1) )
-    x = np.clip(np.ravel(data.get_x(sigma_t)), 0, 1.0)
-    b =  binom.logpmf(data.m, data.t, x)
-    return np.sum(b)
+    ll = _log_likelihood(data.A, sigma, data.m, data.t)
+    return ll + data.log_binomial_coefficient
 
-def fit_llsp(data, n_trials=10):
+def fit_llsp(data, n_trials=10, threads=1, solver='slsqp'):
     """
     fit the log-likelihood sequencing perfect model
 
     :param data: reference data
     :param data: data methylome
     :param n_trials: number of trials to run with random initalizations of sigma
+    :param threads: number of worker processes to run the trials on
+    :param solver: optimizer to run each trial with: [slsqp, lbfgs, minuit, em]
     :return: cell-type proportions
     :rtype: np.array
     """
-    f = lambda x: -1 * log_likelihood_sequencing_perfect(data, x)
-    bnds = [ (0.0, 1.0) ] * data.K
-    cons = ({'type': 'eq', 'fun': eq_constraint})
     alpha = np.array([ 1.0 / data.K ] * data.K)
-    n_trials = 10
-    best_ll = np.inf
-    best_sol = None
     initializations = dirichlet.rvs(alpha, size=n_trials).tolist()
 
-    for (i, init) in enumerate(initializations):
-        res = minimize(f, init, method='SLSQP', options={'maxiter': 100, 'disp':False}, bounds=bnds, constraints=cons)
-        ll = res.get("fun")
-        if ll < best_ll:
-            best_ll = ll
-            best_sol = res
-    return best_sol.x/np.sum(best_sol.x)
+    # sequencing perfect is the error model with p01 = 0 and p11 = 1
+    p01 = np.zeros(data.K)
+    p11 = np.ones(data.K)
+    return fit_multistart(data, p01, p11, initializations, threads, maxiter=100, solver=solver)
 
 def log_likelihood_sequencing_with_errors(data, sigma, p01, p11):
     """
@@ -102,25 +169,8 @@ def log_likelihood_sequencing_with_errors(data, sigma, p01, p11):
     :rtype: float
     """
 
-    sigma_t = sigma.reshape( (data.K, 1) )
-
-    # if p01 is a vector then reshape if not then make it a vector
-    if isinstance(p01, np.ndarray):
-        p01 = p01.reshape( (data.K, 1) )
-    else:
-        p01 = np.array([p01] * data.K).reshape( (data.K, 1) )
-    if isinstance(p11, np.ndarray):
-        p11 = p11.reshape( (data.K, 1) )
-    else:
-        p11 = np.array([p11] * data.K).reshape( (data.K, 1) )
-    p = np.clip(np.ravel(data.get_x(sigma_t, p01, p11)), 0, 1.0)
-    # breakpoint()
-    # x = np.clip(np.ravel(np.dot(data.A, sigma_t)), 0, 1.0)
-    # p = x * p11 + (1-x) * p01
-    b =  binom.logpmf(data.m, data.t, p)
-    binomial_coef = sum([math.log(math.comb(int(t), int(m))) for m,t in zip(data.m, data.t)])
-
-    return np.sum(b) #- binomial_coef
+    ll = _log_likelihood(_error_atlas(data.A, p01, p11), sigma, data.m, data.t)
+    return ll + data.log_binomial_coefficient
 
 def fit_uniform(K):
     """
@@ -132,50 +182,306 @@ def fit_uniform(K):
     """
     return np.array([1.0 / K ] * K)
 
-class my_thread(threading.Thread):
+def _run_slsqp(init, A, m, t, p01, p11, maxiter):
     """
-    thread class for parallel processing of fit_llse
+    Run a single SLSQP trial of the llse objective from one initialization.
+    Only takes numpy arrays so it can be shipped to a worker process.
+
+    :param init: initial cell-type proportions
+    :param A: reference atlas matrix (CpGs x cell-types)
+    :param m: modified calls per CpG
+    :param t: total calls per CpG
+    :param p01: nanopore miscall rate per cell-type
+    :param p11: nanopore correct call rate per cell-type
+    :param maxiter: maximum number of SLSQP iterations
+    :return: (negative log-likelihood, cell-type proportions)
+    :rtype: tuple
     """
-    def __init__(self, data, p01, p11, queue):
-        super(my_thread, self).__init__()
-        self.data = data
-        self.p01 = p01
-        self.p11 = p11
-        self.queue = queue
-        self.res = []
-    def run(self):
-        alpha = self.queue.get()
-        f = lambda x: -1 * log_likelihood_sequencing_with_errors(self.data, x, self.p01, self.p11)
-        bnds = [ (0.0, 1.0) ] * self.data.K
-        cons = ({'type': 'eq', 'fun': eq_constraint})
-        self.res.append(minimize(f, alpha, method='SLSQP', options={'maxiter': 200, 'disp':False}, bounds=bnds, constraints=cons))
+    BT = np.ascontiguousarray(_error_atlas(A, p01, p11).T)
+    out = np.empty((3, A.shape[0]), dtype=BT.dtype)
+    # SLSQP's stopping tolerance is absolute, so optimize the log-likelihood per call;
+    # otherwise it stops early on large methylomes
+    total = np.sum(t, dtype=np.float64)
+    bnds = [ (0.0, 1.0) ] * A.shape[1]
+    cons = ({'type': 'eq', 'fun': eq_constraint, 'jac': eq_constraint_jac})
+    gemv = get_blas_funcs('gemv', (BT,))
+    res = minimize(_neg_log_likelihood_and_grad, init, args=(BT, m, t - m, 1/total, out, gemv), jac=True, method='SLSQP',
+                   options={'maxiter': maxiter, 'disp':False}, bounds=bnds, constraints=cons)
+    return res.fun*total, res.x
 
+def _softmax(theta):
+    """
+    Map K-1 free parameters onto the K-simplex, with the last logit fixed at 0
 
-def fit_llse_parallel(data, p01, p11, n_trials, threads, concentration, init_nnls):
+    :param theta: free parameters
+    :return: cell-type proportions
+    :rtype: np.array
+    """
+    z = np.append(theta, 0.0)
+    z = np.exp(z - np.max(z))
+    return z/np.sum(z)
+
+def _softmax_inverse(sigma):
+    """
+    Inverse of _softmax, with zero proportions clipped to EPS
+
+    :param sigma: cell-type proportions
+    :return: free parameters
+    :rtype: np.array
+    """
+    log_sigma = np.log(np.clip(sigma, EPS, None))
+    return log_sigma[:-1] - log_sigma[-1]
+
+def _softmax_start(sigma):
+    """
+    Starting softmax parameters for an initialization. The initialization is moved
+    halfway towards uniform first: proportions near 0 map to very negative logits,
+    where the softmax gradient vanishes and the cell-type never recovers.
+
+    :param sigma: initial cell-type proportions
+    :return: free parameters
+    :rtype: np.array
+    """
+    sigma = np.asarray(sigma, dtype=np.float64)
+    return _softmax_inverse(0.5*sigma/np.sum(sigma) + 0.5/len(sigma))
+
+def _neg_log_likelihood_and_grad_softmax(theta, BT, m, tm, scale=1.0, out=None, gemv=None):
+    """
+    Negative log-likelihood of the llse model and its gradient with respect to
+    the softmax parameters theta, so it can be minimized without constraints.
+
+    :param theta: free parameters, see _softmax
+    :return: (negative log-likelihood, gradient)
+    :rtype: tuple
+    """
+    sigma = _softmax(theta)
+    f, g = _neg_log_likelihood_and_grad(sigma, BT, m, tm, scale, out, gemv)
+    # chain rule through the softmax Jacobian diag(sigma) - sigma sigma^T
+    g = sigma*(g - np.dot(sigma, g))
+    return f, g[:-1]
+
+def _run_lbfgs(init, A, m, t, p01, p11, maxiter):
+    """
+    Run a single L-BFGS-B trial of the llse objective from one initialization.
+    Sigma is parameterized by a softmax, so there are no bounds or constraints.
+    Takes the same arguments as _run_slsqp.
+
+    :return: (negative log-likelihood, cell-type proportions)
+    :rtype: tuple
+    """
+    BT = np.ascontiguousarray(_error_atlas(A, p01, p11).T)
+    out = np.empty((3, A.shape[0]), dtype=BT.dtype)
+    total = np.sum(t, dtype=np.float64)
+    gemv = get_blas_funcs('gemv', (BT,))
+    res = minimize(_neg_log_likelihood_and_grad_softmax, _softmax_start(init),
+                   args=(BT, m, t - m, 1/total, out, gemv), jac=True, method='L-BFGS-B',
+                   options={'maxiter': maxiter})
+    return res.fun*total, _softmax(res.x)
+
+def _run_minuit(init, A, m, t, p01, p11, maxiter):
+    """
+    Run a single MIGRAD trial of the llse objective over the softmax parameters.
+    Takes the same arguments as _run_slsqp. Each trial builds its own Minuit object:
+    a Minuit object reused from a previous trial starts from that trial's covariance,
+    and MIGRAD then reports convergence away from the optimum.
+
+    :return: (negative log-likelihood, cell-type proportions)
+    :rtype: tuple
+    """
+    if Minuit is None:
+        raise ImportError("the minuit solver requires iminuit, install it with: pip install iminuit")
+    # MIGRAD converges to an absolute EDM on the unscaled log-likelihood, below the
+    # rounding noise of a float32 sum over a large methylome, so work in float64
+    BT = np.ascontiguousarray(_error_atlas(A.astype(np.float64), p01, p11).T)
+    out = np.empty((3, A.shape[0]), dtype=BT.dtype)
+    m = m.astype(np.float64)
+    tm = t.astype(np.float64) - m
+    gemv = get_blas_funcs('gemv', (BT,))
+    # Minuit asks for the value and the gradient separately, share the evaluation between both
+    last = {}
+    def evaluate(theta):
+        if last.get('theta') is None or not np.array_equal(theta, last['theta']):
+            last['theta'] = np.array(theta)
+            last['f'], last['g'] = _neg_log_likelihood_and_grad_softmax(theta, BT, m, tm, 1.0, out, gemv)
+        return last['f'], last['g']
+    minuit = Minuit(lambda theta: evaluate(theta)[0], _softmax_start(init),
+                    grad=lambda theta: evaluate(theta)[1])
+    minuit.errordef = Minuit.LIKELIHOOD
+    minuit.strategy = 0
+    minuit.migrad(ncall=maxiter*A.shape[1])
+    return minuit.fval, _softmax(np.array(minuit.values))
+
+def _em(sigma, B, BT, m, t, max_iter=1000, stop_thresh=1e-6):
+    """
+    Maximize the llse log-likelihood over the simplex by expectation maximization.
+    Every call is softly assigned to the cell-type it came from, which gives the
+    multiplicative update sigma_k <- sigma_k * (B.T @ r + c)_k / sum(t), where
+    r is the gradient residual m/p - (t-m)/(1-p) and c = sum((t-m)/(1-p)).
+    The update stays on the simplex and never decreases the likelihood.
+    sigma may hold one initialization per column, in which case all trials are
+    iterated together with matrix-matrix products instead of one product each.
+
+    :param sigma: initial cell-type proportions (cell-types or cell-types x trials)
+    :param B: error corrected atlas matrix (CpGs x cell-types)
+    :param BT: contiguous transpose of B
+    :param m: modified calls per CpG
+    :param t: total calls per CpG
+    :param max_iter: maximum number of iterations
+    :param stop_thresh: stop once no proportion changes by more than this
+    :return: cell-type proportions, in the shape of sigma
+    :rtype: np.array
+    """
+    sigma = np.array(sigma, dtype=np.float64)
+    shape = sigma.shape
+    # one row per trial, so every trial reads contiguous CpGs
+    sigma = sigma.reshape( (shape[0], -1) ).T.copy()
+    sigma /= np.sum(sigma, axis=1, keepdims=True)
+    tm = t - m
+    total = np.sum(t, dtype=np.float64)
+    for i in range(max_iter):
+        p = np.dot(sigma.astype(B.dtype), BT)
+        np.clip(p, EPS, 1 - EPS, out=p)
+        u = tm/(1-p)
+        r = m/p
+        r -= u
+        sigma_new = sigma * (np.dot(r, B) + np.sum(u, axis=1, dtype=np.float64)[:, None]) / total
+        sigma_new /= np.sum(sigma_new, axis=1, keepdims=True)
+        delta = np.max(np.abs(sigma_new - sigma))
+        sigma = sigma_new
+        if delta < stop_thresh:
+            break
+    return sigma.T.reshape(shape)
+
+def fit_em(data, p01, p11, sigma_init=None, max_iter=1000, stop_thresh=1e-6):
+    """
+    fit the log-likelihood sequencing with errors model by expectation maximization.
+    Several initializations are iterated together, one column each, and the most likely fit is kept
+
+    :param data: data methylome
+    :param p01: nanopore miscall rate
+    :param p11: nanopore correct call rate
+    :param sigma_init: initial cell-type proportions or a list of them, uniform by default
+    :param max_iter: maximum number of iterations
+    :param stop_thresh: stop once no proportion changes by more than this
+    :return: cell-type proportions
+    :rtype: np.array
+    """
+    if sigma_init is None:
+        sigma_init = fit_uniform(data.K)
+    B = _error_atlas(data.A, p01, p11)
+    sigma = _em(np.atleast_2d(sigma_init).T, B, np.ascontiguousarray(B.T), data.m, data.t,
+                max_iter=max_iter, stop_thresh=stop_thresh)
+    best = np.argmax(_log_likelihood(B, sigma, data.m, data.t))
+    return sigma[:, best]
+
+def fit_multistart(data, p01, p11, initializations, threads=1, maxiter=200, solver='slsqp'):
+    """
+    Run independent trials from each initialization and keep the best.
+    Trials are spread over a process pool when more than one thread is requested.
+
+    :param data: data methylome
+    :param p01: nanopore miscall rate
+    :param p11: nanopore correct call rate
+    :param initializations: list of initial cell-type proportions
+    :param threads: number of worker processes
+    :param maxiter: maximum number of optimizer iterations per trial
+    :param solver: optimizer to run each trial with: [slsqp, lbfgs, minuit, em]
+    :return: cell-type proportions
+    :rtype: np.array
+    """
+    if solver == 'em':
+        # all EM trials are iterated together, one column per initialization
+        return fit_em(data, p01, p11, sigma_init=initializations)
+    trials = {'slsqp': _run_slsqp, 'lbfgs': _run_lbfgs, 'minuit': _run_minuit}
+    if solver not in trials:
+        raise ValueError(f"no such solver: {solver}. Choose from [slsqp, lbfgs, minuit, em]")
+    trial = trials[solver]
+    args = (data.A, data.m, data.t, p01, p11, maxiter)
+    if threads > 1 and len(initializations) > 1:
+        # the methylome is handed to each worker once, only initializations are sent per trial
+        with ProcessPoolExecutor(max_workers=min(threads, len(initializations)),
+                                 initializer=_init_worker, initargs=(trial, args)) as pool:
+            run = lambda inits: pool.map(_run_worker_trial, inits)
+            best_x = _multistart_rounds(run, initializations, threads)
+    else:
+        run = lambda inits: [trial(init, *args) for init in inits]
+        best_x = _multistart_rounds(run, initializations, 1)
+    return best_x/np.sum(best_x)
+
+# per worker process state, set by _init_worker
+_WORKER = {}
+
+def _init_worker(trial, args):
+    """
+    Store the trial function and its methylome arguments in a worker process
+
+    :param trial: function running one trial, like _run_slsqp
+    :param args: arguments passed to trial after the initialization
+    """
+    _WORKER['trial'] = trial
+    _WORKER['args'] = args
+
+def _run_worker_trial(init):
+    """
+    Run one trial in a worker process set up by _init_worker
+
+    :param init: initial cell-type proportions
+    :return: (negative log-likelihood, cell-type proportions)
+    :rtype: tuple
+    """
+    return _WORKER['trial'](init, *_WORKER['args'])
+
+def _multistart_rounds(run, initializations, round_size, patience=3, tol=1e-6, scale=0.05):
+    """
+    Run trials in rounds, seeding every third trial with a perturbation of the best solution so far.
+    Stop once `patience` trials in a row fail to improve the best objective by a relative `tol`.
+
+    :param run: function mapping a list of initializations to a list of (fun, x) results
+    :param initializations: list of initial cell-type proportions
+    :param round_size: number of trials to run at once
+    :return: best solution found
+    :rtype: np.array
+    """
+    best_fun, best_x = np.inf, None
+    no_improve = 0
+    for start in range(0, len(initializations), round_size):
+        inits = list(initializations[start:start+round_size])
+        if best_x is not None:
+            for i in range(len(inits)):
+                if (start + i) % 3 == 2:
+                    x = np.clip(best_x + scale*np.random.randn(len(best_x)), 0.0, 1.0)
+                    inits[i] = x/np.sum(x) if np.sum(x) > 0 else inits[i]
+        for fun, x in run(inits):
+            if best_x is None or fun < best_fun - tol*abs(best_fun):
+                best_fun, best_x = fun, x
+                no_improve = 0
+            else:
+                no_improve += 1
+        if no_improve >= patience:
+            break
+    return best_x
+
+def fit_llse_parallel(data, p01, p11, n_trials, threads, concentration, init_nnls, solver='slsqp'):
+    """
+    fit the log-likelihood sequencing with errors model from multiple random initializations
+
+    :param data: data methylome
+    :param p01: nanopore miscall rate
+    :param p11: nanopore correct call rate
+    :param n_trials: number of trials to run with random initalizations of sigma
+    :param threads: number of worker processes to run the trials on
+    :param concentration: concentration of the Dirichlet distribution for initializations
+    :param init_nnls: add the nnls solution as an extra initialization
+    :param solver: optimizer to run each trial with: [slsqp, lbfgs, minuit, em]
+    :return: cell-type proportions
+    :rtype: np.array
+    """
     alpha = np.array([concentration] * data.K)
     initializations = dirichlet.rvs(alpha, size=n_trials).tolist()
     if init_nnls:
-        initializations.append(fit_nnls(data))
-
-    queues = [Queue() for i in range(threads)]
-    res = []
-    for i in range(n_trials):
-        queues[i % threads].put(initializations[i])
-    threads = [my_thread(data, p01, p11, queues[i]) for i in range(threads)]
-    for t in threads:
-        t.start()
-    for t in threads:
-        t.join()
-        res += t.res
-
-    best_ll = np.inf
-    best_sol = None
-    for r in res:
-        ll = r.get("fun")
-        if ll < best_ll:
-            best_ll = ll
-            best_sol = r
-    return best_sol.x/np.sum(best_sol.x)
+        # run first so later trials can be seeded around it
+        initializations.insert(0, fit_nnls(data))
+    return fit_multistart(data, p01, p11, initializations, threads, maxiter=200, solver=solver)
 
 def fit_llse(data, p01, p11):
     """
@@ -185,16 +491,11 @@ def fit_llse(data, p01, p11):
     :param data: data methylome
     :param p01: nanopore miscall rate
     :param p11: nanopore correct call rate
-    :param n_trials: number of trials to run with random initalizations of sigma
     :return: cell-type proportions
     :rtype: np.array
     """
-    f = lambda x: -1 * log_likelihood_sequencing_with_errors(data, x, p01, p11)
-    bnds = [ (0.0, 1.0) ] * data.K
-    cons = ({'type': 'eq', 'fun': eq_constraint})
-    alpha = np.array([ 1.0 / data.K ] * data.K)
-    res = minimize(f, alpha, method='SLSQP', options={'maxiter': 100, 'disp':False}, bounds=bnds, constraints=cons)
-    return res.x/np.sum(res.x)
+    _, x = _run_slsqp(fit_uniform(data.K), data.A, data.m, data.t, p01, p11, maxiter=100)
+    return x/np.sum(x)
 
 def fit_nnls(data):
     """
@@ -206,12 +507,12 @@ def fit_nnls(data):
     :rtype: np.array
     """
 
-    # add sum=1 constraint
-    t = np.array([1.0] * data.K).reshape( (1, data.K) )
-    A = np.append(data.A, t, axis=0)
-    b = np.append(data.x_hat, [1.0], axis=0)
-    res = nnls(A, b)
-    return res[0]/np.sum(res[0])
+    # sum=1 is enforced by renormalizing the unconstrained solution
+    sigma, _ = nnls(data.A, data.x_hat)
+    # an unmethylated methylome fits to all zeros, which has no proportions to renormalize
+    if np.sum(sigma) == 0:
+        return fit_uniform(data.K)
+    return sigma/np.sum(sigma)
 
 def fit_mmse(methylome, atlas, sigma, p01, p11, stop_thresh, max_iter, min_proportion, concentration,
              true_sigma=None, true_assignments=None):
@@ -2,6 +2,10 @@
 import unittest
 import os
 import sys
+import io
+import contextlib
+import tempfile
+import pathlib
 
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
@@ -74,6 +78,81 @@ class TestMain(unittest.TestCase):
         # check that the cell_type proportion values are close
         self.assertAlmostEqual(cell_type_proportions['cell1'], 0.7, places=1)
 
+class TestDeconvoluteSamples(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.atlas = os.path.join(cls.tmp.name, 'atlas.tsv')
+        rng = np.random.default_rng(0)
+        K, n_regions = 3, 300
+        with open(cls.atlas, 'w') as f:
+            f.write('chr\tstart\tend\t' + '\t'.join(f'cell{k}' for k in range(K)) + '\n')
+            A = rng.beta(0.5, 0.5, (n_regions, K))
+            for i in range(n_regions):
+                f.write(f'chr1\t{i*100}\t{i*100+99}\t' + '\t'.join(str(a) for a in A[i]) + '\n')
+        # two samples with identical calls under different names, and a third mixture
+        cls.methylomes = [os.path.join(cls.tmp.name, f'sample{i}.tsv') for i in range(3)]
+        for path, sigma in zip(cls.methylomes, [[0.2, 0.3, 0.5], [0.2, 0.3, 0.5], [0.6, 0.3, 0.1]]):
+            calls = np.random.default_rng(1).binomial(20, A @ sigma)
+            with open(path, 'w') as f:
+                f.write('chr\tstart\tend\ttotal_calls\tmodified_calls\n')
+                for i in range(n_regions):
+                    f.write(f'chr1\t{i*100}\t{i*100+99}\t20\t{calls[i]}\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def deconvolute(self, methylome, **kwargs):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            proportions = deconvolute(methylome, self.atlas, 'llse', min_proportion=0.0, **kwargs)
+        return proportions, stdout.getvalue().splitlines()
+
+    def test_samples_match_single_sample_fits(self):
+        proportions, lines = self.deconvolute(self.methylomes, threads=2)
+        self.assertEqual(list(proportions), self.methylomes)
+        self.assertEqual(lines[0], 'sample\tcell_type\tproportion')
+        self.assertEqual(len(lines), 1 + 3*3)
+        for line in lines[1:]:
+            path, cell_type, proportion = line.split('\t')
+            self.assertAlmostEqual(proportions[path][cell_type], float(proportion))
+        for path in self.methylomes:
+            single, single_lines = self.deconvolute(path)
+            self.assertEqual(single_lines[0], 'cell_type\tproportion')
+            for cell_type in single:
+                self.assertAlmostEqual(proportions[path][cell_type], single[cell_type], places=2)
+        # identical calls give identical proportions, whichever worker fits them
+        for cell_type in proportions[self.methylomes[0]]:
+            self.assertAlmostEqual(proportions[self.methylomes[0]][cell_type],
+                                   proportions[self.methylomes[1]][cell_type], places=2)
+
+    def test_samples_are_reproducible(self):
+        np.random.seed(0)
+        first, _ = self.deconvolute(self.methylomes, threads=2, solver='em', n_trials=2)
+        np.random.seed(0)
+        second, _ = self.deconvolute(self.methylomes, threads=3, solver='em', n_trials=2)
+        self.assertEqual(first, second)
+
+    def test_duplicate_samples(self):
+        paths = [self.methylomes[0], self.methylomes[2], self.methylomes[0]]
+        proportions, lines = self.deconvolute(paths, threads=2, print_output=True)
+        self.assertEqual(list(proportions), [self.methylomes[0], self.methylomes[2]])
+        self.assertEqual(len(lines), 1 + 2*3)
+
+    def test_path_sample(self):
+        # a pathlib.Path is one methylome, not an iterable of samples
+        np.random.seed(0)
+        proportions, lines = self.deconvolute(pathlib.Path(self.methylomes[2]))
+        self.assertEqual(lines[0], 'cell_type\tproportion')
+        np.random.seed(0)
+        single, _ = self.deconvolute(self.methylomes[2])
+        self.assertEqual(proportions, single)
+
+        paths = [pathlib.Path(path) for path in self.methylomes[1:]]
+        proportions, _ = self.deconvolute(paths, threads=2)
+        self.assertEqual(list(proportions), paths)
 
 
 if __name__ == '__main__':
@@ -2,13 +2,15 @@
 import unittest
 import os
 import sys
-
+import tempfile
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 parent_dir = os.path.dirname(script_dir)
 sys.path.append(parent_dir)
 
 from tools import *
+from atlas import *
+from atlas import _join_atlas_overlap, _read_atlas, _read_atlas_ranges
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 methylome = os.path.join(script_dir, 'test_data', 'test_methylome.tsv')
@@ -55,6 +57,105 @@ class TestMain(unittest.TestCase):
         print(reference_atlas.A)
 
 
+class TestJoinAtlas(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.atlas = os.path.join(cls.tmp.name, 'atlas.tsv')
+        cls.cell_types = ['cell0', 'cell1']
+        # regions on several chromosomes, so sorting by name (chr1, chr10, chr2) matters
+        cls.regions = [(chrom, i*100, i*100+99) for chrom in ['chr2', 'chr10', 'chr1'] for i in range(3)]
+        write_regions(cls.atlas, cls.regions, np.random.rand(len(cls.regions), 2))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def methylome(self, rows):
+        df = pd.DataFrame(rows, columns=['Chromosome', 'Start', 'End', 'total_calls', 'modified_calls'])
+        return df.sample(frac=1, random_state=0).reset_index(drop=True)
+
+    def assertJoinsMatch(self, df, atlas=None):
+        atlas = atlas or self.atlas
+        df_join = join_atlas(df, atlas, self.cell_types)
+        df_overlap = _join_atlas_overlap(df, atlas, self.cell_types)
+        self.assertEqual(list(df_join.index), list(df_overlap.index))
+        # the overlap join keeps PyRanges' categorical chromosomes, compare the values only
+        pd.testing.assert_frame_equal(df_join.reset_index(drop=True), df_overlap[df_join.columns].reset_index(drop=True),
+                                      check_dtype=False)
+        return df_join
+
+    def test_exact_regions(self):
+        # every region is covered, some by repeated rows
+        rows = [(*r, 2, 1) for r in self.regions] + [(*r, 3, 3) for r in self.regions[::2]]
+        df_join = self.assertJoinsMatch(self.methylome(rows))
+        self.assertEqual(df_join.total_calls.sum(), 2*len(self.regions) + 3*len(self.regions[::2]))
+        self.assertEqual(list(df_join.index.get_level_values('Chromosome').unique()), ['chr1', 'chr10', 'chr2'])
+
+    def test_subset_of_regions(self):
+        rows = [(*r, 4, 2) for r in self.regions[1::3]]
+        df_join = self.assertJoinsMatch(self.methylome(rows))
+        self.assertEqual(len(df_join), len(self.regions[1::3]))
+
+    def test_exact_and_overlapping_rows(self):
+        # reads inside a region and reads spanning into the next one fall back to the overlap join
+        rows = [(*r, 2, 1) for r in self.regions]
+        rows += [('chr10', 10, 50, 1, 1), ('chr1', 150, 250, 5, 2)]
+        df_join = self.assertJoinsMatch(self.methylome(rows))
+        self.assertEqual(df_join.loc[('chr10', 0, 99), 'total_calls'], 3)
+        self.assertEqual(df_join.loc[('chr1', 100, 199), 'total_calls'], 7)
+        self.assertEqual(df_join.loc[('chr1', 200, 299), 'total_calls'], 7)
+
+    def test_overlapping_regions(self):
+        # a row that is exactly one region still overlaps the other one it falls in
+        atlas = os.path.join(self.tmp.name, 'overlapping.tsv')
+        write_regions(atlas, [('chr1', 0, 200), ('chr1', 100, 300)], np.random.rand(2, 2))
+        df_join = self.assertJoinsMatch(self.methylome([('chr1', 100, 300, 4, 2)]), atlas=atlas)
+        self.assertEqual(list(df_join.total_calls), [4, 4])
+
+    def test_get_x(self):
+        methylome = os.path.join(self.tmp.name, 'methylome.tsv')
+        self.methylome([(*r, 4, 2) for r in self.regions]).rename(columns={'Chromosome': 'chr', 'Start': 'start', 'End': 'end'}) \
+            .to_csv(methylome, sep='\t', index=False)
+        data = AtlasMethylome(methylome, self.atlas)
+        A = data.A.astype(np.float64)
+        sigma = np.array([0.3, 0.7])
+        p01, p11 = np.array([0.05, 0.1]), np.array([0.95, 0.9])
+
+        np.testing.assert_allclose(data.get_x(sigma), A @ sigma, rtol=1e-6)
+        np.testing.assert_allclose(data.get_x(sigma.reshape(-1, 1)), A @ sigma, rtol=1e-6)
+        np.testing.assert_allclose(data.get_x(sigma, p01, p11), A @ (sigma*p11) + (1-A) @ (sigma*p01), rtol=1e-6)
+        np.testing.assert_allclose(data.get_x(sigma, 0.05, 0.95), A @ (sigma*0.95) + (1-A) @ (sigma*0.05), rtol=1e-6)
+        out = np.empty(len(data), dtype=data.A.dtype)
+        self.assertIs(data.get_x(sigma, p01, p11, out=out), out)
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_parquet_cache(self):
+        atlas = os.path.join(self.tmp.name, 'cached.tsv')
+        values = np.random.rand(len(self.regions), 2)
+        write_regions(atlas, self.regions, values)
+        df_atlas = read_atlas(atlas).df
+        self.assertTrue(os.path.exists(atlas + '.parquet'))
+
+        # a fresh process reads the same atlas back from the cache
+        _read_atlas.cache_clear()
+        _read_atlas_ranges.cache_clear()
+        pd.testing.assert_frame_equal(read_atlas(atlas).df, df_atlas)
+
+        # rewriting the atlas invalidates the cache, even with an older modification time
+        mtime_ns = os.stat(atlas).st_mtime_ns
+        write_regions(atlas, self.regions, values/2)
+        os.utime(atlas, ns=(mtime_ns - 10**9, mtime_ns - 10**9))
+        _read_atlas.cache_clear()
+        _read_atlas_ranges.cache_clear()
+        self.assertAlmostEqual(read_atlas(atlas).df.cell0.sum(), df_atlas.cell0.sum()/2, places=5)
+
+def write_regions(path, regions, values):
+    with open(path, 'w') as f:
+        f.write('chr\tstart\tend\tcell0\tcell1\n')
+        for (chrom, start, end), (v0, v1) in zip(regions, values):
+            f.write(f'{chrom}\t{start}\t{end}\t{v0}\t{v1}\n')
 
 
 if __name__ == '__main__':
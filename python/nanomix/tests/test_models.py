@@ -0,0 +1,159 @@
+# Test the llse optimizers in models.py
+import unittest
+import os
+import sys
+import types
+
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+parent_dir = os.path.dirname(script_dir)
+sys.path.append(parent_dir)
+
+from models import *
+from models import _error_atlas, _log_likelihood, _em, _run_slsqp, _run_lbfgs, _run_minuit
+from models import _neg_log_likelihood_and_grad, _multistart_rounds
+
+def simulate(n_cpgs=3000, K=6, seed=0):
+    """
+    Simulate an atlas and the calls of a methylome drawn from it, with one rare cell type
+    """
+    rng = np.random.default_rng(seed)
+    A = rng.beta(0.5, 0.5, (n_cpgs, K)).astype(np.float32)
+    sigma = rng.dirichlet(np.ones(K))
+    sigma[-1] = 0.03
+    sigma /= np.sum(sigma)
+    p01, p11 = np.full(K, 0.05), np.full(K, 0.95)
+    t = rng.integers(1, 20, n_cpgs).astype(np.float32)
+    m = rng.binomial(t.astype(int), _error_atlas(A, p01, p11).astype(np.float64) @ sigma).astype(np.float32)
+    return A, m, t, p01, p11, sigma
+
+class TestModels(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.A, cls.m, cls.t, cls.p01, cls.p11, cls.sigma = simulate()
+        cls.K = cls.A.shape[1]
+        B = _error_atlas(cls.A, cls.p01, cls.p11)
+        # the EM optimum, run to a tight tolerance, is the reference for every solver
+        cls.sigma_em = _em(np.full(cls.K, 1/cls.K), B, np.ascontiguousarray(B.T), cls.m, cls.t,
+                           max_iter=10000, stop_thresh=1e-10)
+        cls.nll_em = -_log_likelihood(B, cls.sigma_em, cls.m, cls.t)
+        np.random.seed(0)
+        cls.inits = dirichlet.rvs(np.full(cls.K, 1/cls.K), size=10)
+
+    def assertOptimal(self, nll):
+        self.assertLess(nll, self.nll_em + 1e-5*abs(self.nll_em))
+
+    def test_lbfgs_from_sparse_inits(self):
+        # Dirichlet(1/K) draws put proportions near 0, every trial must still reach the optimum
+        for init in self.inits:
+            nll, sigma = _run_lbfgs(init, self.A, self.m, self.t, self.p01, self.p11, 200)
+            self.assertOptimal(nll)
+            np.testing.assert_allclose(sigma, self.sigma_em, atol=5e-3)
+
+    def fit(self, solver, threads=1):
+        data = types.SimpleNamespace(A=self.A, m=self.m, t=self.t, K=self.K)
+        return fit_multistart(data, self.p01, self.p11, list(self.inits), threads=threads, solver=solver)
+
+    def assertRecovers(self, sigma):
+        self.assertAlmostEqual(np.sum(sigma), 1.0)
+        np.testing.assert_allclose(sigma, self.sigma_em, atol=5e-3)
+        np.testing.assert_allclose(sigma, self.sigma, atol=0.05)
+
+    def test_slsqp(self):
+        self.assertRecovers(self.fit('slsqp'))
+
+    def test_slsqp_pool(self):
+        self.assertRecovers(self.fit('slsqp', threads=2))
+
+    def test_lbfgs(self):
+        self.assertRecovers(self.fit('lbfgs'))
+
+    def test_em(self):
+        self.assertRecovers(self.fit('em'))
+
+    def test_fit_em(self):
+        data = types.SimpleNamespace(A=self.A, m=self.m, t=self.t, K=self.K)
+        # a single initialization, uniform by default, or several iterated together
+        self.assertRecovers(fit_em(data, self.p01, self.p11))
+        self.assertRecovers(fit_em(data, self.p01, self.p11, sigma_init=self.inits[0]))
+        self.assertRecovers(fit_em(data, self.p01, self.p11, sigma_init=list(self.inits)))
+
+    @unittest.skipIf(Minuit is None, "iminuit is not installed")
+    def test_minuit(self):
+        self.assertRecovers(self.fit('minuit'))
+        for init in self.inits[:3]:
+            self.assertOptimal(_run_minuit(init, self.A, self.m, self.t, self.p01, self.p11, 200)[0])
+
+    def test_nnls(self):
+        data = types.SimpleNamespace(A=self.A, x_hat=self.m/self.t, K=self.K)
+        sigma = fit_nnls(data)
+        self.assertAlmostEqual(np.sum(sigma), 1.0)
+        # no methylated calls at all gives the zero fit, reported as uniform proportions
+        data.x_hat = np.zeros(len(self.m))
+        np.testing.assert_array_equal(fit_nnls(data), fit_uniform(self.K))
+
+    def test_slsqp_trials(self):
+        for init in self.inits:
+            self.assertOptimal(_run_slsqp(init, self.A, self.m, self.t, self.p01, self.p11, 200)[0])
+
+    def test_unknown_solver(self):
+        with self.assertRaises(ValueError):
+            self.fit('newton')
+
+    def test_em_batched(self):
+        # iterating all initializations together matches iterating each one alone
+        B = _error_atlas(self.A, self.p01, self.p11)
+        BT = np.ascontiguousarray(B.T)
+        inits = self.inits[:4]
+        batched = _em(np.column_stack(inits), B, BT, self.m, self.t, max_iter=50)
+        for k, init in enumerate(inits):
+            np.testing.assert_allclose(batched[:, k], _em(init, B, BT, self.m, self.t, max_iter=50), atol=1e-6)
+
+    def test_gradient(self):
+        # analytic gradient against central finite differences, in float64
+        BT = np.ascontiguousarray(_error_atlas(self.A.astype(np.float64), self.p01, self.p11).T)
+        m, tm = self.m.astype(np.float64), (self.t - self.m).astype(np.float64)
+        sigma, h = self.inits[1]*0.5 + 0.5/self.K, 1e-6
+        _, grad = _neg_log_likelihood_and_grad(sigma, BT, m, tm)
+        for k in range(self.K):
+            e = np.zeros(self.K)
+            e[k] = h
+            f_plus, _ = _neg_log_likelihood_and_grad(sigma + e, BT, m, tm)
+            f_minus, _ = _neg_log_likelihood_and_grad(sigma - e, BT, m, tm)
+            self.assertAlmostEqual(grad[k], (f_plus - f_minus)/(2*h), delta=1e-4*abs(grad[k]))
+
+class TestMultistartRounds(unittest.TestCase):
+
+    def run_trials(self, funs):
+        self.trials = []
+        def run(inits):
+            res = []
+            for init in inits:
+                self.trials.append(np.array(init))
+                res.append((funs[len(self.trials) - 1], np.array(init)))
+            return res
+        return run
+
+    def test_stops_without_improvement(self):
+        inits = [np.full(3, 1/3)]*10
+        best = _multistart_rounds(self.run_trials([5.0, 4.0] + [4.0]*8), inits, 1)
+        # the first two trials improve, the next three do not
+        self.assertEqual(len(self.trials), 5)
+        np.testing.assert_allclose(best, inits[1])
+
+    def test_seeds_around_best(self):
+        inits = [np.eye(3)[k % 3] for k in range(6)]
+        _multistart_rounds(self.run_trials([3.0, 2.0, 1.0, 0.5, 0.4, 0.3]), inits, 2)
+        self.assertEqual(len(self.trials), 6)
+        # every third trial after the first round starts near the best solution so far
+        for k, trial in enumerate(self.trials):
+            self.assertAlmostEqual(np.sum(trial), 1.0)
+            if k in [2, 5]:
+                self.assertFalse(np.array_equal(trial, inits[k]))
+            else:
+                np.testing.assert_array_equal(trial, inits[k])
+
+
+if __name__ == '__main__':
+    unittest.main()
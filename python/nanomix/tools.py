@@ -28,6 +28,9 @@ def get_vectorized_error_param(file, cell_types):
 def eq_constraint(x):
     return 1 - np.sum(x)
 
+def eq_constraint_jac(x):
+    return -np.ones_like(x)
+
 def get_cell_types(atlas):
     """
     Open atlas file and read the header to get the cell types order